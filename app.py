@@ -1,93 +1,536 @@
 #!/usr/bin/env python3
 import os
-import json
+
+# Hilos de cómputo por worker: los núcleos se reparten entre los workers de gunicorn
+# para no sobresuscribir la CPU. Debe fijarse antes de importar numpy/cv2/paddle
+WORKERS = int(os.environ.get('GUNICORN_WORKERS', 1))
+# CPUs realmente asignadas al contenedor (cpuset), no las del host
+AVAILABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+# Con gunicorn llega ya calculado en OCR_CPU_THREADS (el worker puede estar fijado a su tramo)
+CPU_THREADS = int(os.environ.get('OCR_CPU_THREADS', max(1, AVAILABLE_CPUS // WORKERS)))
+os.environ.setdefault('OMP_NUM_THREADS', str(CPU_THREADS))
+os.environ.setdefault('MKL_NUM_THREADS', str(CPU_THREADS))
+os.environ.setdefault('OMP_PROC_BIND', 'close')
+os.environ.setdefault('OMP_PLACES', 'cores')
+# Intel OpenMP (MKL/oneDNN): hilos que duermen al acabar cada región paralela en vez
+# de girar. Sin KMP_AFFINITY: junto a OMP_PROC_BIND haría que este se ignorase
+os.environ.setdefault('KMP_BLOCKTIME', '0')
+# Caché global de primitivas oneDNN: las formas de entrada varían por página y línea
+os.environ.setdefault('DNNL_PRIMITIVE_CACHE_CAPACITY', '1024')
+
 import time
-import tempfile
 import numpy as np
 import cv2
+import fitz
 import math
-from pathlib import Path
+import hashlib
+import io
+import threading
+import queue
+import traceback
+import orjson
+from collections import OrderedDict
+from concurrent.futures import Future
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from PIL import Image
+import paddle
+from paddleocr import PaddleOCR
+from paddlex.inference import load_pipeline_config
+
+# BLAKE3 (SIMD) para el hash de contenido; blake2b de hashlib si no está instalado
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# OpenCV solo decodifica y redimensiona en los hilos de petición: con su propio pool
+# competiría con los hilos OMP de Paddle por los mismos núcleos
+cv2.setNumThreads(int(os.environ.get('OCR_OPENCV_THREADS', 1)))
+
+class OrjsonProvider(JSONProvider):
+    """JSON con orjson: serializa ndarrays y escalares NumPy sin .tolist()"""
+    option = orjson.OPT_SERIALIZE_NUMPY
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option),
+                                        mimetype='application/json')
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Tope del cuerpo de la petición: el upload se lee entero en memoria
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('OCR_MAX_UPLOAD_MB', 50)) * 1024 * 1024
 
-UPLOAD_FOLDER = '/app/data/input'
 OUTPUT_FOLDER = '/app/data/output'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf', 'bmp', 'tiff'}
+ALLOWED_SUFFIXES = frozenset({'.png', '.jpg', '.jpeg', '.pdf', '.bmp', '.tiff'})
 
 ocr_instances = {}
-supported_languages = ["en", "es"]
+_ocr_events = {}
+_init_lock = threading.Lock()
+supported_languages = frozenset({"en", "es"})
 default_lang = "es"
 ocr_initialized = False
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Modelo multilingüe único para todos los idiomas (p. ej. 'latin' cubre en y es):
+# una sola instancia en memoria. Vacío = una instancia por idioma
+SHARED_LANG = os.environ.get('OCR_SHARED_LANG', '')
+
+# Inferencia de alto rendimiento (HPI): PaddleOCR elige el mejor backend
+# disponible (OpenVINO / ONNX Runtime / Paddle Inference) para det y rec
+ENABLE_HPI = os.environ.get('OCR_ENABLE_HPI', '1') == '1'
+# Backend HPI fijo (openvino / onnxruntime / tensorrt / paddle); vacío = selección automática
+HPI_BACKEND = os.environ.get('OCR_HPI_BACKEND', '')
+# Dispositivo de inferencia ('cpu', 'gpu:0'...); vacío = el que elija PaddleOCR
+DEVICE = os.environ.get('OCR_DEVICE', '')
+# Abortar el arranque si no hay GPU en lugar de degradar en silencio a CPU
+REQUIRE_GPU = os.environ.get('OCR_REQUIRE_GPU', '0') == '1'
+if REQUIRE_GPU and not DEVICE:
+    DEVICE = 'gpu:0'
+# Precisión de cómputo ('fp32' / 'fp16'); fp16 solo tiene efecto en GPU con TensorRT
+PRECISION = os.environ.get('OCR_PRECISION', '')
+# TensorRT en GPU (fusiona capas; el primer arranque construye los engines)
+USE_TENSORRT = os.environ.get('OCR_USE_TENSORRT', '0') == '1'
+
+# Caché LRU de respuestas por hash de contenido (0 = desactivada)
+RESULT_CACHE_SIZE = int(os.environ.get('OCR_CACHE_SIZE', 256))
+# Tope aproximado de memoria de la caché (respuestas detalladas de PDFs pesan varios MB)
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_MB', 200)) * 1024 * 1024
+_result_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+# Compartir entre idiomas los modelos independientes del idioma (det, orientación de línea)
+SHARE_MODELS = os.environ.get('OCR_SHARE_MODELS', '1') == '1'
+SHAREABLE_MODELS = ('text_det_model', 'textline_orientation_model')
+
+# Ventana de agrupación de peticiones concurrentes hacia un mismo predictor (ms en el entorno)
+BATCH_WINDOW = float(os.environ.get('OCR_BATCH_WINDOW_MS', 10)) / 1000
+# Tope de imágenes por predict(): acota la memoria de activaciones del lote
+MAX_BATCH_SIZE = int(os.environ.get('OCR_MAX_BATCH_SIZE', 8))
+# Segundos de inactividad tras los que el predictor hace una inferencia sintética de
+# 64x64 con las opciones por defecto de /process (mantiene pesos en RAM y el pool de
+# hilos activo). Coste en reposo: unos ms de CPU por intervalo, por idioma cargado y
+# por worker; 0 = desactivado
+KEEPALIVE_INTERVAL = float(os.environ.get('OCR_KEEPALIVE_INTERVAL', 60))
+
+# Páginas en vuelo por petición: el rasterizado de la siguiente solapa con el OCR de la anterior
+PIPELINE_DEPTH = max(1, int(os.environ.get('OCR_PIPELINE_DEPTH', 4)))
+
+# Peticiones con OCR en curso por proceso (decodificación + inferencia); el resto espera
+# hasta OCR_INFLIGHT_TIMEOUT y recibe 503. 0 = sin límite (los hilos de gunicorn ya acotan)
+MAX_INFLIGHT = int(os.environ.get('OCR_MAX_INFLIGHT', 0))
+INFLIGHT_TIMEOUT = float(os.environ.get('OCR_INFLIGHT_TIMEOUT', 30))
+_inflight = threading.BoundedSemaphore(MAX_INFLIGHT) if MAX_INFLIGHT > 0 else None
+
+# Resolución de rasterizado de PDF (PyMuPDF, en proceso)
+PDF_DPI = int(os.environ.get('OCR_PDF_DPI', 300))
+PDF_MAX_PAGES = int(os.environ.get('OCR_PDF_MAX_PAGES', 10))
+
+# Tamaño de entrada del detector: lado largo limitado a 1056px, que en un A4 (1:1.41)
+# deja el lado corto en ~736px. 'min' es un mínimo (solo amplía imágenes con el lado
+# corto menor) y no reduciría las páginas escaneadas. Un A4 a 300 ppp se detecta a
+# ~1/3 de resolución: la letra muy pequeña (< ~7 pt) puede perderse; subir det_side
+# por petición o OCR_DET_LIMIT_SIDE_LEN para esos documentos
+DET_LIMIT_SIDE_LEN = int(os.environ.get('OCR_DET_LIMIT_SIDE_LEN', 1056))
+DET_LIMIT_TYPE = os.environ.get('OCR_DET_LIMIT_TYPE', 'max')
+# det_side de cada petición se redondea al siguiente de estos tamaños: menos formas
+# distintas para oneDNN y más peticiones agrupables en el mismo predict(). Vacío = sin redondeo
+DET_SIDE_BUCKETS = {int(v) for v in os.environ.get('OCR_DET_SIDE_BUCKETS', '480,736,960,1280,1600').split(',') if v.strip()}
+# El tamaño por defecto siempre es un bucket exacto
+DET_SIDE_BUCKETS = tuple(sorted(DET_SIDE_BUCKETS | {DET_LIMIT_SIDE_LEN})) if DET_SIDE_BUCKETS else ()
+
+# Lado largo máximo de las imágenes subidas (fotos de 12 MP); 0 = sin límite
+MAX_IMAGE_SIDE = int(os.environ.get('OCR_MAX_IMAGE_SIDE', 1600))
+
+# Recortes por lote en reconocimiento y clasificador de orientación de línea.
+# 1 mantiene pequeña la arena de memoria de Paddle (en CPU el lote apenas gana
+# velocidad); subir a 32 si sobra memoria y se procesan páginas densas
+REC_BATCH_SIZE = int(os.environ.get('OCR_REC_BATCH_SIZE', 1))
+
+# Cargar el clasificador de orientación de línea (necesario para cls=true).
+# 0 = configuración mínima: solo detección y reconocimiento (app_simple.py)
+TEXTLINE_ORIENTATION = os.environ.get('OCR_TEXTLINE_ORIENTATION', '1') == '1'
+
+# Formas de entrada distintas que Paddle guarda compiladas para MKLDNN por predictor
+MKLDNN_CACHE_CAPACITY = int(os.environ.get('OCR_MKLDNN_CACHE_CAPACITY', 10))
+
+# Modelos alternativos (p. ej. variantes mobile o exportaciones cuantizadas a int8).
+# Nombre de modelo oficial y/o directorio local; vacío = el que PaddleOCR elige por idioma.
+# El reconocedor afecta a todos los idiomas: usar junto con OCR_SHARED_LANG
+MODEL_OVERRIDES = {
+    param: os.environ[env]
+    for param, env in (
+        ('text_detection_model_name', 'OCR_DET_MODEL_NAME'),
+        ('text_detection_model_dir', 'OCR_DET_MODEL_DIR'),
+        ('text_recognition_model_name', 'OCR_REC_MODEL_NAME'),
+        ('text_recognition_model_dir', 'OCR_REC_MODEL_DIR'),
+    )
+    if os.environ.get(env)
+}
+
+# Forma de entrada fija del reconocedor, p. ej. '3,48,320': evita reconstruir
+# engines TensorRT / reajustar kernels con cada ancho de línea. Vacío = dinámica
+REC_INPUT_SHAPE = tuple(int(v) for v in os.environ.get('OCR_REC_INPUT_SHAPE', '').split(',') if v.strip())
+
+def snap_det_side(side):
+    """Redondea det_side al bucket inmediatamente superior (el mayor como tope)"""
+    for bucket in DET_SIDE_BUCKETS:
+        if side <= bucket:
+            return bucket
+    return DET_SIDE_BUCKETS[-1] if DET_SIDE_BUCKETS else side
+
+def limit_max_pages(value):
+    """max_pages de la petición con OCR_PDF_MAX_PAGES como techo (<= 0 pide el techo)"""
+    requested = int(value)
+    if PDF_MAX_PAGES <= 0:
+        return requested
+    return min(requested, PDF_MAX_PAGES) if requested > 0 else PDF_MAX_PAGES
+
+def file_suffix(filename):
+    """Extensión en minúsculas con el punto ('' si no tiene)"""
+    _, dot, ext = filename.rpartition('.')
+    return dot + ext.lower() if dot else ''
 
-def calculate_intelligent_side_len(image_path):
-    """Cálculo inteligente de side_len como tu amigo"""
+# Reducción 1/8, 1/4, 1/2 dentro del propio decodificador JPEG (escalado DCT de libjpeg)
+JPEG_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                      (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def image_long_side(data):
+    """Lado largo leyendo solo la cabecera, sin decodificar píxeles"""
     try:
-        img = cv2.imread(str(image_path))
-        if img is None:
-            return 960
+        with Image.open(io.BytesIO(data)) as im:
+            return max(im.size)
+    except Exception:
+        return None
+
+def decode_image(data, suffix=''):
+    """Decodifica la imagen subida desde memoria (BGR); devuelve (img, escala respecto al original)"""
+    flag = cv2.IMREAD_COLOR
+    original_side = None
+    if MAX_IMAGE_SIDE > 0 and suffix in ('.jpg', '.jpeg'):
+        original_side = image_long_side(data)
+        # Mayor reducción que no baje de MAX_IMAGE_SIDE; el resto lo ajusta limit_image_side
+        for factor, reduced_flag in JPEG_REDUCED_FLAGS:
+            if original_side and original_side // factor >= MAX_IMAGE_SIDE:
+                flag = reduced_flag
+                break
+    
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if img is None:
+        return None, 1.0
+    img, scale = limit_image_side(img)
+    if flag != cv2.IMREAD_COLOR:
+        scale = max(img.shape[:2]) / original_side
+    return img, scale
+
+def limit_image_side(img):
+    """Reduce la imagen si su lado largo supera MAX_IMAGE_SIDE; devuelve (img, escala)"""
+    long_side = max(img.shape[:2])
+    if MAX_IMAGE_SIDE <= 0 or long_side <= MAX_IMAGE_SIDE:
+        return img, 1.0
+    scale = MAX_IMAGE_SIDE / long_side
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+def pixmap_to_bgr(pix):
+    """Pixmap RGB(A) a ndarray BGR: vista sin copia de los píxeles y una única conversión"""
+    img = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return cv2.cvtColor(img, cv2.COLOR_RGBA2BGR if pix.n == 4 else cv2.COLOR_RGB2BGR)
+
+def render_pdf_pages(pdf_data, max_pages=PDF_MAX_PAGES):
+    """Rasteriza las páginas de un PDF a ndarrays BGR sin pasar por disco, una a una"""
+    with fitz.open(stream=pdf_data, filetype='pdf') as doc:
+        page_count = min(doc.page_count, max_pages) if max_pages > 0 else doc.page_count
+        for page_number in range(page_count):
+            pix = doc.load_page(page_number).get_pixmap(dpi=PDF_DPI, colorspace=fitz.csRGB, alpha=False)
+            yield pixmap_to_bgr(pix)
+
+def ocr_pipelined(ocr, images, **predict_args):
+    """OCR en cadena: cada imagen se encola al producirse, con como mucho PIPELINE_DEPTH en vuelo"""
+    futures = []
+    for img in images:
+        if len(futures) >= PIPELINE_DEPTH:
+            futures[-PIPELINE_DEPTH].result()
+        futures.append(ocr.submit([img], **predict_args))
+    return [page_result for future in futures for page_result in future.result()]
+
+def hpi_pipeline_config():
+    """Configuración del pipeline OCR de PaddleX con el backend HPI fijado"""
+    config = load_pipeline_config('OCR')
+    config['hpi_config'] = {'backend': HPI_BACKEND}
+    return config
+
+def check_gpu():
+    """Falla al arrancar si se exige GPU y Paddle no ve ninguna"""
+    gpu_count = paddle.device.cuda.device_count() if paddle.device.is_compiled_with_cuda() else 0
+    print(f"🖥️ Paddle {paddle.__version__}: {gpu_count} GPU(s) CUDA visibles, dispositivo '{DEVICE}'")
+    if gpu_count == 0:
+        raise RuntimeError("OCR_REQUIRE_GPU=1 pero Paddle no detecta ninguna GPU CUDA")
+
+def create_ocr(lang):
+    """Crea una instancia PaddleOCR con HPI si está disponible"""
+    config = {
+        'lang': lang,
+        'enable_mkldnn': True,
+        'mkldnn_cache_capacity': MKLDNN_CACHE_CAPACITY,
+        'cpu_threads': CPU_THREADS,
+        'text_recognition_batch_size': REC_BATCH_SIZE,
+        'textline_orientation_batch_size': REC_BATCH_SIZE,
+        'text_det_limit_side_len': DET_LIMIT_SIDE_LEN,
+        'text_det_limit_type': DET_LIMIT_TYPE,
+        # Documentos rectos: sin clasificador de orientación de página ni unwarping.
+        # El clasificador de línea se carga pero solo se usa con cls=true
+        'use_doc_orientation_classify': False,
+        'use_doc_unwarping': False,
+        'use_textline_orientation': TEXTLINE_ORIENTATION,
+    }
+    if DEVICE:
+        config['device'] = DEVICE
+    if PRECISION:
+        config['precision'] = PRECISION
+    if USE_TENSORRT:
+        config['use_tensorrt'] = True
+    if REC_INPUT_SHAPE:
+        config['text_rec_input_shape'] = REC_INPUT_SHAPE
+    config.update(MODEL_OVERRIDES)
+    
+    if ENABLE_HPI:
+        hpi_args = {'enable_hpi': True}
+        if HPI_BACKEND:
+            try:
+                hpi_args['paddlex_config'] = hpi_pipeline_config()
+            except Exception as e:
+                print(f"⚠️ No se pudo fijar el backend HPI '{HPI_BACKEND}': {e}")
+        try:
+            return PaddleOCR(**hpi_args, **config)
+        except Exception as e:
+            print(f"⚠️ HPI no disponible para '{lang}', usando Paddle Inference: {e}")
+    
+    return PaddleOCR(**config)
+
+class OcrBatcher:
+    """Cola delante de un predictor: un único hilo agrupa peticiones concurrentes en un solo predict()"""
+    
+    def __init__(self, ocr, run_lock=None):
+        self.ocr = ocr
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        # Compartido entre instancias que comparten predictores (no son thread-safe)
+        self.run_lock = run_lock or threading.Lock()
+    
+    def submit(self, images, **kwargs):
+        """Encola imágenes sin bloquear; el Future devuelve sus resultados"""
+        future = Future()
+        self._ensure_worker()
+        self.queue.put((images, kwargs, future))
+        return future
+    
+    def predict(self, images, **kwargs):
+        return self.submit(images, **kwargs).result()
+    
+    def _ensure_worker(self):
+        # Los hilos no sobreviven a un fork: se arranca en el proceso que lo usa
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, name='ocr-batcher', daemon=True)
+                    self.thread.start()
+    
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=KEEPALIVE_INTERVAL or None)
+            except queue.Empty:
+                self._keepalive()
+                continue
+            
+            pending = [first]
+            batch_images = len(pending[0][0])
+            deadline = time.monotonic() + BATCH_WINDOW
+            while batch_images < MAX_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                batch_images += len(item[0])
+            
+            # Solo se agrupan peticiones con las mismas opciones de predict()
+            groups = {}
+            for item in pending:
+                groups.setdefault(tuple(sorted(item[1].items())), []).append(item)
+            for items in groups.values():
+                self._dispatch(items)
+    
+    def _keepalive(self):
+        """Predictor inactivo: inferencia mínima para que la siguiente petición no llegue en frío"""
+        try:
+            with self.run_lock:
+                self.ocr.predict([keepalive_image()], text_det_limit_side_len=DET_LIMIT_SIDE_LEN,
+                                 use_textline_orientation=False)
+        except Exception as e:
+            print(f"⚠️ Keep-alive fallido: {e}")
+    
+    def _dispatch(self, items):
+        images = [img for imgs, _, _ in items for img in imgs]
+        try:
+            with self.run_lock:
+                results = self.ocr.predict(images, **items[0][1])
+        except Exception as e:
+            if len(items) == 1:
+                items[0][2].set_exception(e)
+                return
+            # Una imagen defectuosa no debe tumbar las peticiones ajenas del lote:
+            # se repite cada petición por separado y solo falla la culpable
+            print(f"⚠️ Lote de {len(items)} peticiones fallido, reintento individual: {e}")
+            for item in items:
+                self._dispatch([item])
+            return
         
-        h, w = img.shape[:2]
-        side_len = int(math.ceil(max(h, w) * max(0.8, 960 / max(h, w))))
-        print(f"📐 Imagen {w}x{h} -> side_len: {side_len}px")
-        return side_len
-    except:
-        return 960
+        # Devolver a cada petición su tramo de resultados
+        offset = 0
+        for imgs, _, future in items:
+            future.set_result(results[offset:offset + len(imgs)])
+            offset += len(imgs)
+
+def _paddlex_pipeline(ocr):
+    """Pipeline PaddleX interno de una instancia PaddleOCR (API privada)"""
+    pipeline = getattr(ocr, 'paddlex_pipeline', None)
+    return getattr(pipeline, '_pipeline', pipeline)
+
+def share_models(source, target):
+    """Reutiliza en target los modelos de source cuando son el mismo modelo"""
+    src, dst = _paddlex_pipeline(source), _paddlex_pipeline(target)
+    shared = []
+    for attr in SHAREABLE_MODELS:
+        src_model, dst_model = getattr(src, attr, None), getattr(dst, attr, None)
+        if src_model is None or dst_model is None:
+            continue
+        if getattr(src_model, 'model_name', None) != getattr(dst_model, 'model_name', None):
+            continue
+        setattr(dst, attr, src_model)
+        shared.append(attr)
+    return shared
+
+def warmup_image():
+    """Página sintética con texto: una imagen en blanco no pasaría de la detección"""
+    img = np.full((640, 640, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(('PaddleOCR warmup 0123456789', 'Factura N. 2024-001 Total 1.234,56')):
+        cv2.putText(img, line, (20, 80 + i * 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    return img
+
+def keepalive_image():
+    """Imagen mínima con texto para el keep-alive: detección y reconocimiento casi gratis"""
+    img = np.full((64, 64, 3), 255, dtype=np.uint8)
+    cv2.putText(img, '0123', (4, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+    return img
+
+def warmup_ocr(ocr):
+    """Inferencia sintética para reservar memoria y primitivas MKLDNN antes del tráfico real"""
+    try:
+        # Detección, orientación de línea y reconocimiento se ejecutan al menos una vez
+        ocr.predict([warmup_image()], use_textline_orientation=TEXTLINE_ORIENTATION)
+    except Exception as e:
+        print(f"⚠️ Warmup fallido: {e}")
+
+def warmup_loaded_ocr():
+    """Warmup de las instancias ya cargadas (heredadas del master de gunicorn con --preload)"""
+    for batcher in list(ocr_instances.values()):
+        warmup_ocr(batcher)
 
 def initialize_ocr():
-    global ocr_instances, ocr_initialized
+    global ocr_initialized
     
     if ocr_initialized:
         return True
     
+    print("🚀 Inicializando PaddleOCR 3.0.2...")
+    for lang in supported_languages:
+        if get_ocr_instance(lang) is None:
+            return False
+    
+    ocr_initialized = True
+    print("✅ OCR inicializado exitosamente")
+    return True
+
+def get_ocr_instance(language=None, warmup=True):
+    """Instancia por idioma: la primera llamada la construye, las concurrentes esperan"""
+    lang = language if language in supported_languages else default_lang
+    lang = SHARED_LANG or lang
+    
+    # Camino rápido sin lock una vez cargado el modelo
+    ocr = ocr_instances.get(lang)
+    if ocr is not None:
+        return ocr
+    
+    with _init_lock:
+        ocr = ocr_instances.get(lang)
+        if ocr is not None:
+            return ocr
+        event = _ocr_events.get(lang)
+        is_loader = event is None
+        if is_loader:
+            event = _ocr_events[lang] = threading.Event()
+    
+    if not is_loader:
+        event.wait()
+        return ocr_instances.get(lang)
+    
+    # Construcción fuera del lock: solo espera quien pide este mismo idioma
     try:
-        print("🚀 Inicializando PaddleOCR 3.0.2...")
-        from paddleocr import PaddleOCR
-        
-        # Configuración SIMPLE que funciona
-        ocr_instances["es"] = PaddleOCR(lang='es')
-        ocr_instances["en"] = PaddleOCR(lang='en')
+        ocr = create_ocr(lang)
+        if warmup:
+            warmup_ocr(ocr)
         
-        ocr_initialized = True
-        print("✅ OCR inicializado exitosamente")
-        return True
+        # Los pesos duplicados de target se liberan al sustituir sus predictores
+        run_lock = None
+        if SHARE_MODELS:
+            for other in list(ocr_instances.values()):
+                shared = share_models(other.ocr, ocr)
+                if shared:
+                    print(f"♻️ '{lang}' comparte {', '.join(shared)}")
+                    run_lock = other.run_lock
+                    break
         
+        ocr_instances[lang] = OcrBatcher(ocr, run_lock)
     except Exception as e:
         print(f"❌ Error: {e}")
-        import traceback
         traceback.print_exc()
-        return False
-
-def get_ocr_instance(language=None):
-    global ocr_instances, ocr_initialized
-    
-    if not ocr_initialized:
-        if not initialize_ocr():
-            return None
+    finally:
+        with _init_lock:
+            del _ocr_events[lang]
+        event.set()
     
-    lang = language or default_lang
-    return ocr_instances.get(lang, ocr_instances.get("es"))
+    return ocr_instances.get(lang)
 
 def detect_text_orientation_improved(coordinates):
     """Detección mejorada de orientación"""
     try:
         if len(coordinates) >= 4:
-            x_coords = [point[0] for point in coordinates]
-            y_coords = [point[1] for point in coordinates]
-            
-            width = max(x_coords) - min(x_coords)
-            height = max(y_coords) - min(y_coords)
+            # Una conversión y reducciones en C en lugar de listas de x/y en Python
+            c = np.asarray(coordinates, dtype=np.float32)
+            mn, mx = c.min(axis=0), c.max(axis=0)
+            width = mx[0] - mn[0]
+            height = mx[1] - mn[1]
             
             if width == 0:
                 return 'vertical'
             
             aspect_ratio = height / width
-            p1, p2 = coordinates[0], coordinates[1]
-            angle = abs(np.arctan2(p2[1] - p1[1], p2[0] - p1[0]) * 180 / np.pi)
+            # math.atan2 sobre escalares evita el despacho de ufuncs de np.arctan2
+            angle = abs(math.degrees(math.atan2(c[1, 1] - c[0, 1], c[1, 0] - c[0, 0])))
             
             if aspect_ratio > 2.5:
                 return 'vertical'
@@ -101,19 +544,98 @@ def detect_text_orientation_improved(coordinates):
         pass
     return 'horizontal'
 
-def analyze_text_orientations(coordinates_list):
-    """Análisis de orientaciones"""
-    orientations = {'horizontal': 0, 'vertical': 0, 'rotated': 0}
+_RAD2DEG = np.float32(180.0 / np.pi)
+# Código entero de orientación -> etiqueta de la respuesta
+ORIENTATION_LABELS = ('horizontal', 'vertical', 'rotated')
+
+def classify_orientations(coordinates_list):
+    """Códigos de orientación (índices de ORIENTATION_LABELS) de todos los bloques en una sola pasada NumPy"""
+    if len(coordinates_list) == 0:
+        return np.zeros(0, dtype=np.int8)
+    try:
+        polys = np.asarray(coordinates_list, dtype=np.float32)
+    except ValueError:
+        polys = None
+    if polys is None or polys.ndim != 3 or polys.shape[1] < 4:
+        # Polígonos irregulares: cálculo bloque a bloque
+        return np.array([ORIENTATION_LABELS.index(detect_text_orientation_improved(coords))
+                         for coords in coordinates_list], dtype=np.int8)
     
-    for coords in coordinates_list:
-        orientation = detect_text_orientation_improved(coords)
-        orientations[orientation] += 1
+    # Estructura de arrays: una columna por magnitud, N cajas a la vez
+    xs, ys = polys[:, :, 0], polys[:, :, 1]
+    width = xs.max(axis=1) - xs.min(axis=1)
+    height = ys.max(axis=1) - ys.min(axis=1)
+    # Ancho 0 -> relación infinita -> vertical
+    aspect_ratio = np.divide(height, width, out=np.full_like(height, np.inf), where=width > 0)
+    # Todo en float32 y en el mismo buffer: sin temporales de float64
+    angle = np.arctan2(ys[:, 1] - ys[:, 0], xs[:, 1] - xs[:, 0])
+    angle *= _RAD2DEG
+    np.abs(angle, out=angle)
     
-    return orientations
+    # Mismo orden de reglas que detect_text_orientation_improved
+    return np.select(
+        [aspect_ratio > 2.5, (angle > 25) & (angle < 155), aspect_ratio > 1.8],
+        [1, 2, 1],
+        default=0).astype(np.int8)
+
+def analyze_text_orientations(block_orientations):
+    """Análisis de orientaciones: recuento por código con un solo bincount"""
+    counts = np.bincount(block_orientations, minlength=len(ORIENTATION_LABELS))
+    return dict(zip(ORIENTATION_LABELS, counts.tolist()))
+
+def content_digest(data):
+    """Hash del contenido subido para la clave de caché (bytes crudos, sin pasar a hex)"""
+    if blake3 is not None:
+        return blake3(data).digest(length=16)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def response_size(response):
+    """Estimación barata de la memoria de una respuesta: texto más bloques y polígonos"""
+    size = len(response['text']) + 256 * response['total_blocks']
+    for block in response.get('blocks', ()):
+        size += getattr(block['coordinates'], 'nbytes', 0)
+    return size
+
+# Campos que solo añade el modo detallado
+DETAILED_KEYS = frozenset({'blocks', 'min_confidence', 'max_confidence',
+                           'total_coordinates', 'orientation_details'})
+
+def cache_get(key):
+    with _cache_lock:
+        entry = _result_cache.get(key)
+        if entry is None:
+            return None
+        _result_cache.move_to_end(key)
+        return entry[0]
+
+def cache_put(key, response):
+    global _cache_bytes
+    if RESULT_CACHE_SIZE <= 0:
+        return
+    size = response_size(response)
+    if size > RESULT_CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        previous = _result_cache.pop(key, None)
+        if previous is not None:
+            _cache_bytes -= previous[1]
+        _result_cache[key] = (response, size)
+        _cache_bytes += size
+        while len(_result_cache) > RESULT_CACHE_SIZE or _cache_bytes > RESULT_CACHE_MAX_BYTES:
+            _, (_, evicted_size) = _result_cache.popitem(last=False)
+            _cache_bytes -= evicted_size
+
+# Cuerpos de /health serializados una vez: las sondas del balanceador no reconstruyen nada
+HEALTH_BODIES = {
+    ready: orjson.dumps({'status': 'healthy', 'ocr_ready': ready})
+    for ready in (True, False)
+}
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'healthy', 'ocr_ready': ocr_initialized})
+    # Listo cuando están cargados todos los idiomas precargados (sin precarga: siempre)
+    ready = all((SHARED_LANG or lang) in ocr_instances for lang in PRELOAD_LANGS)
+    return app.response_class(HEALTH_BODIES[ready], mimetype='application/json')
 
 @app.route('/init')
 def init_models():
@@ -126,42 +648,116 @@ def init_models():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'error': 'File too large',
+                    'max_upload_mb': app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)}), 413
+
+def multipart_upload():
+    """(nombre, stream) del campo 'file' de un formulario multipart; None si falta"""
+    if 'file' not in request.files:
+        return None
+    file = request.files['file']
+    return file.filename, file.stream
+
+def raw_upload():
+    """(nombre, stream) de un cuerpo binario: el nombre va en ?filename= o en X-Filename"""
+    filename = request.args.get('filename') or request.headers.get('X-Filename')
+    if not filename:
+        return None
+    # Sin parser multipart: el cuerpo se lee una sola vez, directamente del socket
+    return filename, request.stream
+
 @app.route('/process', methods=['POST'])
 def process_file():
+    return process_upload(multipart_upload, request.form)
+
+@app.route('/process_stream', methods=['POST'])
+def process_stream():
+    return process_upload(raw_upload, request.args)
+
+def process_upload(get_upload, params):
+    """OCR de un upload; params son las opciones (formulario o query string)"""
     start_time = time.time()
+    inflight_acquired = False
     
     try:
-        if not ocr_initialized:
-            if not initialize_ocr():
-                return jsonify({'error': 'OCR not initialized'}), 503
-        
-        if 'file' not in request.files:
+        upload = get_upload()
+        if upload is None:
             return jsonify({'error': 'No file provided'}), 400
         
-        file = request.files['file']
-        if not file or not allowed_file(file.filename):
+        raw_filename, stream = upload
+        # Extensión calculada una vez: valida el tipo y elige la ruta PDF/imagen
+        suffix = file_suffix(raw_filename or '')
+        if suffix not in ALLOWED_SUFFIXES:
             return jsonify({'error': 'Invalid file'}), 400
         
-        language = request.form.get('language', default_lang)
-        detailed = request.form.get('detailed', 'false').lower() == 'true'
+        language = params.get('language', default_lang)
+        # Un idioma no soportado no se procesa en silencio con el modelo por defecto
+        if language not in supported_languages:
+            return jsonify({'error': f'Unsupported language: {language}',
+                            'supported_languages': sorted(supported_languages)}), 400
+        detailed = params.get('detailed', 'false').lower() == 'true'
+        # El cliente puede pedir menos páginas que el operador, nunca más
+        try:
+            max_pages = limit_max_pages(params.get('max_pages', PDF_MAX_PAGES))
+        except ValueError:
+            return jsonify({'error': 'Invalid max_pages'}), 400
+        try:
+            det_side = int(params.get('det_side', DET_LIMIT_SIDE_LEN))
+        except ValueError:
+            det_side = 0
+        if det_side <= 0:
+            return jsonify({'error': 'Invalid det_side'}), 400
+        det_side = snap_det_side(det_side)
+        # Clasificador de orientación de línea solo bajo demanda ('angle' como alias de 'cls')
+        use_cls = (TEXTLINE_ORIENTATION and
+                   params.get('cls', params.get('angle', 'false')).lower() in ('true', '1'))
+        
+        filename = secure_filename(raw_filename)
+        
+        # Upload en memoria: sin escritura ni relectura en disco
+        data = stream.read()
+        
+        # Mismo contenido y mismas opciones: el resultado OCR es idéntico
+        cache_key = (content_digest(data),
+                     language, detailed, max_pages, det_side, use_cls)
+        cached = cache_get(cache_key)
+        if cached is None and not detailed:
+            # La respuesta detallada del mismo contenido incluye la básica
+            cached = cache_get(cache_key[:2] + (True,) + cache_key[3:])
+            if cached is not None:
+                cached = {k: v for k, v in cached.items() if k not in DETAILED_KEYS}
+        if cached is not None:
+            return jsonify({**cached,
+                            'filename': filename,
+                            'cached': True,
+                            'processing_time': round(time.time() - start_time, 3)})
         
         ocr = get_ocr_instance(language)
         if ocr is None:
             return jsonify({'error': 'OCR not available'}), 503
         
-        filename = secure_filename(file.filename)
+        # Contrapresión: las respuestas cacheadas no ocupan hueco
+        if _inflight is not None:
+            if not _inflight.acquire(timeout=INFLIGHT_TIMEOUT):
+                return jsonify({'error': 'Server busy, retry later'}), 503
+            inflight_acquired = True
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(filename).suffix) as tmp_file:
-            file.save(tmp_file.name)
-            
-            try:
-                # NUEVO: OCR directo con .predict() (funciona para PDF e imágenes)
-                print(f"🔍 Procesando {filename} con PaddleOCR 3.0.2...")
-                result = ocr.predict(tmp_file.name)
-                print(f"✅ OCR completado")
-                
-            finally:
-                os.remove(tmp_file.name)
+        if suffix == '.pdf':
+            # Generador: la página siguiente se rasteriza mientras se procesa la anterior
+            images = render_pdf_pages(data, max_pages)
+            coord_scale = 1.0
+        else:
+            img, coord_scale = decode_image(data, suffix)
+            if img is None:
+                return jsonify({'error': 'Invalid image'}), 400
+            images = [img]
+        
+        print(f"🔍 Procesando {filename} con PaddleOCR 3.0.2...")
+        result = ocr_pipelined(ocr, images, text_det_limit_side_len=det_side,
+                               use_textline_orientation=use_cls)
+        print(f"✅ OCR completado")
         
         # Extraer datos del resultado usando la estructura que funciona
         if not result or len(result) == 0:
@@ -171,16 +767,31 @@ def process_file():
                 'processing_time': time.time() - start_time
             })
         
-        page_result = result[0]
-        text_lines = page_result.get('rec_texts', [])
-        confidences = page_result.get('rec_scores', [])
-        coordinates_list = page_result.get('dt_polys', [])
+        # Acumular bloques de todas las páginas
+        text_lines, confidences, coordinates_list, block_pages = [], [], [], []
+        for page_number, page_result in enumerate(result, start=1):
+            page_texts = page_result.get('rec_texts', [])
+            text_lines.extend(page_texts)
+            confidences.extend(page_result.get('rec_scores', []))
+            # rec_polys va alineado con rec_texts (dt_polys incluye cajas descartadas)
+            page_polys = page_result.get('rec_polys', page_result.get('dt_polys', []))
+            if coord_scale != 1.0:
+                # Coordenadas devueltas en píxeles de la imagen original
+                page_polys = [np.rint(poly / coord_scale).astype(np.int32) for poly in page_polys]
+            else:
+                # orjson solo serializa ndarrays C-contiguos; sin copia si ya lo son
+                page_polys = [np.ascontiguousarray(poly) for poly in page_polys]
+            coordinates_list.extend(page_polys)
+            block_pages.extend([page_number] * len(page_texts))
         
-        # Analizar orientaciones
-        orientations = analyze_text_orientations(coordinates_list)
+        # Analizar orientaciones (todas las cajas a la vez)
+        block_orientations = classify_orientations(coordinates_list)
+        orientations = analyze_text_orientations(block_orientations)
         
         # Estadísticas
-        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        # Una sola conversión a NumPy para media, mínimo, máximo y redondeo
+        scores = np.asarray(confidences, dtype=np.float64)
+        avg_confidence = float(scores.mean()) if scores.size else 0.0
         processing_time = time.time() - start_time
         
         # Respuesta básica
@@ -188,6 +799,7 @@ def process_file():
             'success': True,
             'text': '\n'.join(text_lines),
             'total_blocks': len(text_lines),
+            'pages': len(result),
             'filename': filename,
             'language': language,
             'avg_confidence': round(avg_confidence, 3) if avg_confidence > 0 else None,
@@ -202,26 +814,26 @@ def process_file():
         
         # Modo detallado
         if detailed:
-            blocks_with_coords = []
-            for i, text in enumerate(text_lines):
-                block_info = {'text': text}
-                
-                if i < len(confidences):
-                    block_info['confidence'] = round(confidences[i], 3)
-                
-                if i < len(coordinates_list):
-                    coords = coordinates_list[i]
-                    if hasattr(coords, 'tolist'):
-                        coords = coords.tolist()
-                    block_info['coordinates'] = coords
-                    block_info['orientation'] = detect_text_orientation_improved(coords)
-                
-                blocks_with_coords.append(block_info)
+            # Una sola pasada con zip; los scores se redondean de golpe en NumPy
+            rounded_scores = np.round(scores, 3).tolist()
+            blocks_with_coords = [
+                {
+                    'text': text,
+                    'page': page,
+                    'confidence': score,
+                    # orjson serializa el ndarray directamente
+                    'coordinates': coords,
+                    'orientation': ORIENTATION_LABELS[code]
+                }
+                for text, page, score, coords, code
+                in zip(text_lines, block_pages, rounded_scores, coordinates_list,
+                       block_orientations.tolist())
+            ]
             
             response.update({
                 'blocks': blocks_with_coords,
-                'min_confidence': round(min(confidences), 3) if confidences else None,
-                'max_confidence': round(max(confidences), 3) if confidences else None,
+                'min_confidence': round(float(scores.min()), 3) if scores.size else None,
+                'max_confidence': round(float(scores.max()), 3) if scores.size else None,
                 'total_coordinates': len(coordinates_list),
                 'orientation_details': {
                     'horizontal_blocks': orientations.get('horizontal', 0),
@@ -230,20 +842,52 @@ def process_file():
                 }
             })
         
+        cache_put(cache_key, response)
         return jsonify(response)
         
+    except RequestEntityTooLarge:
+        # Lo responde upload_too_large (también salta al parsear el formulario)
+        raise
     except Exception as e:
         processing_time = time.time() - start_time
         print(f"❌ Error: {e}")
-        import traceback
         traceback.print_exc()
         return jsonify({
             'error': str(e),
             'processing_time': round(processing_time, 3)
         }), 500
+    finally:
+        if inflight_acquired:
+            _inflight.release()
+
+if REQUIRE_GPU:
+    check_gpu()
+
+# Idiomas precargados (separados por comas); el resto se carga bajo demanda en la
+# primera petición. Vacío = ninguno
+PRELOAD_LANGS = [lang.strip() for lang in os.environ.get('OCR_PRELOAD_LANGS', default_lang).split(',')
+                 if lang.strip() in supported_languages]
+
+def preload_ocr(warmup=True):
+    """Carga los idiomas de PRELOAD_LANGS uno tras otro (el siguiente puede compartir modelos)"""
+    for lang in PRELOAD_LANGS:
+        get_ocr_instance(lang, warmup=warmup)
+
+# Precarga de PRELOAD_LANGS
+#   '1'    -> en segundo plano, solapada con el arranque del servidor
+#   'sync' -> en el import (gunicorn --preload): los pesos se cargan una vez en el master
+#             y los workers los heredan copy-on-write. Sin warmup antes del fork: los
+#             pools de hilos de OMP no sobreviven al fork y cada worker hace el suyo
+#   'worker' -> nada en el import: gunicorn carga en cada worker tras el fork
+#             (post_worker_init); sin copy-on-write, cada worker con sus pesos
+OCR_PRELOAD = os.environ.get('OCR_PRELOAD', '1')
+if OCR_PRELOAD == 'sync':
+    preload_ocr(warmup=False)
+elif OCR_PRELOAD == '1':
+    threading.Thread(target=preload_ocr, name='ocr-preload', daemon=True).start()
 
+# Producción: gunicorn -c gunicorn.conf.py app:app (este bloque es solo para depuración local)
 if __name__ == '__main__':
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
     
     print("🚀 PaddleOCR 3.0.2 Server iniciando...")
@@ -0,0 +1,68 @@
+# Configuración de Gunicorn para el servidor PaddleOCR
+# Uso: gunicorn -c gunicorn.conf.py app:app
+import os
+import threading
+
+bind = '0.0.0.0:8501'
+
+# Con preload los modelos se cargan una vez en el master y se comparten copy-on-write.
+# OCR_PRELOAD=worker: el master solo importa el código y cada worker carga sus modelos
+# tras el fork (por si un backend HPI no tolerase el fork tras compilar)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+if preload_app:
+    os.environ.setdefault('OCR_PRELOAD', 'sync')
+
+# Un proceso por cada ~4 núcleos: Paddle paraleliza cada inferencia con sus propios hilos
+cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+workers = int(os.environ.get('GUNICORN_WORKERS', max(1, cpu_count // 4)))
+# app.py reparte los hilos OMP/MKL entre este número de workers
+os.environ['GUNICORN_WORKERS'] = str(workers)
+# Hilos por worker calculados aquí, con la máscara completa: sin preload, app.py se importa
+# tras post_fork y ya solo vería su tramo de CPUs (dividiría dos veces)
+os.environ.setdefault('OCR_CPU_THREADS', str(max(1, cpu_count // workers)))
+# Los hilos solo atienden E/S y decodificación: las inferencias de cada proceso
+# pasan en serie por su OcrBatcher, así que el predictor nunca se usa en paralelo.
+# GUNICORN_THREADS=1 da un worker síncrono clásico (sin agrupación de peticiones)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Heartbeat de workers en tmpfs para no bloquear en disco
+worker_tmp_dir = '/dev/shm'
+
+# Conexiones HTTP/1.1 persistentes (mayor que el idle timeout típico de un proxy: 60s)
+keepalive = 65
+
+# El OCR de PDFs multipágina puede superar el timeout por defecto (30s)
+timeout = 120
+
+# Reciclar workers periódicamente: PaddleOCR retiene memoria entre peticiones
+max_requests = 500
+max_requests_jitter = 50
+
+def pre_fork(server, worker):
+    """En el master: asigna al nuevo worker el hueco de CPUs libre más bajo"""
+    # worker.age solo crece y el reciclado con jitter es en orden aleatorio: el hueco
+    # se toma de los workers vivos (el reemplazado ya no está en server.WORKERS)
+    taken = {getattr(w, 'cpu_slot', None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+def post_fork(server, worker):
+    """Fija cada worker a un subconjunto disjunto de CPUs"""
+    if os.environ.get('GUNICORN_PIN_CPUS', '1') != '1' or not hasattr(os, 'sched_setaffinity'):
+        return
+    
+    cpus = sorted(os.sched_getaffinity(0))
+    per_worker = len(cpus) // workers
+    # Workers de más (TTIN o recarga con los antiguos vivos) se quedan sin fijar
+    if per_worker < 1 or worker.cpu_slot >= workers:
+        return
+    
+    slot = worker.cpu_slot
+    os.sched_setaffinity(0, cpus[slot * per_worker:(slot + 1) * per_worker])
+
+def post_worker_init(worker):
+    """Con preload, cada worker carga (OCR_PRELOAD=worker) o calienta sus predictores tras el fork"""
+    if preload_app:
+        import app
+        target = app.preload_ocr if app.OCR_PRELOAD == 'worker' else app.warmup_loaded_ocr
+        threading.Thread(target=target, name='ocr-warmup', daemon=True).start()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Sin precarga de modelos ni keep-alive: los tests usan predictores simulados
+os.environ.setdefault('OCR_PRELOAD', '0')
+os.environ.setdefault('OCR_KEEPALIVE_INTERVAL', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
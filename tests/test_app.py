@@ -0,0 +1,281 @@
+import io
+import threading
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import pytest
+
+# app.py importa paddle/paddleocr al cargarse
+pytest.importorskip('paddleocr')
+
+import app
+
+
+class StubOCR:
+    """Predictor simulado: un resultado por imagen y registro de cada llamada"""
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+
+    def predict(self, images, **kwargs):
+        self.calls.append((list(images), kwargs))
+        if self.fail_on is not None and any(img is self.fail_on for img in images):
+            raise ValueError('bad image')
+        return [{'image': img, 'kwargs': kwargs} for img in images]
+
+
+class PageOCR:
+    """Predictor simulado con la estructura de resultado de PaddleOCR 3"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, images, **kwargs):
+        self.calls += 1
+        return [{'rec_texts': ['hola', 'vertical'],
+                 'rec_scores': [0.9, 0.7],
+                 'rec_polys': [np.array([[0, 0], [100, 0], [100, 20], [0, 20]], np.int16),
+                               np.array([[0, 0], [10, 0], [10, 80], [0, 80]], np.int16)]}
+                for _ in images]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    app._result_cache.clear()
+    monkeypatch.setattr(app, '_cache_bytes', 0)
+    yield
+    app._result_cache.clear()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    ocr = PageOCR()
+    monkeypatch.setitem(app.ocr_instances, app.SHARED_LANG or 'es', app.OcrBatcher(ocr))
+    client = app.app.test_client()
+    client.ocr = ocr
+    return client
+
+
+def png_bytes(width=400, height=300):
+    ok, buf = cv2.imencode('.png', np.full((height, width, 3), 255, np.uint8))
+    return buf.tobytes()
+
+
+def post_image(client, data=None, **form):
+    form['file'] = (io.BytesIO(data or png_bytes()), 'doc.png')
+    return client.post('/process', data=form, content_type='multipart/form-data')
+
+
+# --- Utilidades puras ---
+
+def test_snap_det_side_rounds_up_to_bucket(monkeypatch):
+    monkeypatch.setattr(app, 'DET_SIDE_BUCKETS', (480, 736, 1056))
+    assert app.snap_det_side(100) == 480
+    assert app.snap_det_side(736) == 736
+    assert app.snap_det_side(737) == 1056
+    assert app.snap_det_side(5000) == 1056
+
+
+def test_snap_det_side_without_buckets(monkeypatch):
+    monkeypatch.setattr(app, 'DET_SIDE_BUCKETS', ())
+    assert app.snap_det_side(999) == 999
+
+
+def test_limit_max_pages_is_a_ceiling(monkeypatch):
+    monkeypatch.setattr(app, 'PDF_MAX_PAGES', 10)
+    assert app.limit_max_pages('3') == 3
+    assert app.limit_max_pages('50') == 10
+    assert app.limit_max_pages('0') == 10
+    assert app.limit_max_pages('-1') == 10
+    with pytest.raises(ValueError):
+        app.limit_max_pages('abc')
+
+
+def test_limit_max_pages_without_ceiling(monkeypatch):
+    monkeypatch.setattr(app, 'PDF_MAX_PAGES', 0)
+    assert app.limit_max_pages('50') == 50
+
+
+def test_file_suffix():
+    assert app.file_suffix('Scan.PDF') == '.pdf'
+    assert app.file_suffix('a.b.jpg') == '.jpg'
+    assert app.file_suffix('noext') == ''
+
+
+def test_decode_image_scales_oversize_images(monkeypatch):
+    monkeypatch.setattr(app, 'MAX_IMAGE_SIDE', 1600)
+    img, scale = app.decode_image(png_bytes(3200, 800), '.png')
+    assert img.shape[:2] == (400, 1600)
+    assert scale == pytest.approx(0.5)
+
+
+def test_decode_image_reduced_jpeg_scale(monkeypatch):
+    monkeypatch.setattr(app, 'MAX_IMAGE_SIDE', 1000)
+    ok, buf = cv2.imencode('.jpg', np.full((1000, 4000, 3), 255, np.uint8))
+    img, scale = app.decode_image(buf.tobytes(), '.jpg')
+    assert max(img.shape[:2]) == 1000
+    assert scale == pytest.approx(0.25)
+
+
+def test_decode_image_keeps_small_images_and_rejects_garbage():
+    img, scale = app.decode_image(png_bytes(), '.png')
+    assert img.shape[:2] == (300, 400) and scale == 1.0
+    assert app.decode_image(b'garbage', '.png') == (None, 1.0)
+
+
+def test_classify_orientations_matches_scalar_version():
+    rng = np.random.default_rng(0)
+    polys = [rng.integers(-50, 500, (4, 2)).astype(np.int16) for _ in range(500)]
+    codes = app.classify_orientations(polys)
+    expected = [app.detect_text_orientation_improved(p) for p in polys]
+    assert [app.ORIENTATION_LABELS[c] for c in codes.tolist()] == expected
+    counts = app.analyze_text_orientations(codes)
+    assert counts == {label: expected.count(label) for label in app.ORIENTATION_LABELS}
+
+
+# --- Caché de respuestas ---
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(app, 'RESULT_CACHE_SIZE', 2)
+    for key in ('a', 'b'):
+        app.cache_put(key, {'text': key, 'total_blocks': 0})
+    assert app.cache_get('a') is not None  # 'b' pasa a ser el más antiguo
+    app.cache_put('c', {'text': 'c', 'total_blocks': 0})
+    assert app.cache_get('b') is None
+    assert app.cache_get('a')['text'] == 'a'
+    assert app.cache_get('c')['text'] == 'c'
+
+
+def test_cache_respects_byte_budget(monkeypatch):
+    monkeypatch.setattr(app, 'RESULT_CACHE_MAX_BYTES', 1000)
+    app.cache_put('big', {'text': 'x' * 2000, 'total_blocks': 0})
+    assert app.cache_get('big') is None
+    app.cache_put('a', {'text': 'x' * 600, 'total_blocks': 0})
+    app.cache_put('b', {'text': 'x' * 600, 'total_blocks': 0})
+    assert app.cache_get('a') is None
+    assert app._cache_bytes <= 1000
+
+
+def test_basic_request_served_from_detailed_cache(client):
+    detailed = post_image(client, detailed='true').get_json()
+    assert 'blocks' in detailed
+    basic = post_image(client).get_json()
+    assert basic['cached'] is True
+    assert client.ocr.calls == 1
+    assert not app.DETAILED_KEYS & basic.keys()
+    assert basic['text'] == detailed['text']
+
+
+def test_detailed_request_not_served_from_basic_cache(client):
+    post_image(client)
+    detailed = post_image(client, detailed='true').get_json()
+    assert 'blocks' in detailed
+    assert client.ocr.calls == 2
+
+
+# --- Validación de la petición ---
+
+def test_invalid_params_return_400(client):
+    assert post_image(client, max_pages='abc').status_code == 400
+    assert post_image(client, det_side='abc').status_code == 400
+    assert post_image(client, det_side='0').status_code == 400
+    assert post_image(client, language='xx').status_code == 400
+
+
+def test_upload_too_large_returns_json_413(client, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 100)
+    response = post_image(client)
+    assert response.status_code == 413
+    assert response.get_json()['error'] == 'File too large'
+    response = client.post('/process_stream?filename=doc.png', data=png_bytes())
+    assert response.status_code == 413
+
+
+def test_process_stream_uses_raw_body(client):
+    response = client.post('/process_stream?filename=doc.png&detailed=true', data=png_bytes())
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['filename'] == 'doc.png' and len(body['blocks']) == 2
+    assert client.post('/process_stream', data=png_bytes()).status_code == 400
+
+
+# --- OcrBatcher ---
+
+def test_dispatch_slices_results_per_request():
+    ocr = StubOCR()
+    batcher = app.OcrBatcher(ocr)
+    items = [(['a', 'b'], {}, Future()), (['c'], {}, Future()), (['d', 'e'], {}, Future())]
+    batcher._dispatch(items)
+    assert len(ocr.calls) == 1
+    assert [[r['image'] for r in f.result()] for _, _, f in items] == [['a', 'b'], ['c'], ['d', 'e']]
+
+
+def test_dispatch_isolates_failing_request():
+    bad = object()
+    ocr = StubOCR(fail_on=bad)
+    batcher = app.OcrBatcher(ocr)
+    items = [(['a'], {}, Future()), ([bad], {}, Future()), (['c'], {}, Future())]
+    batcher._dispatch(items)
+    assert [r['image'] for r in items[0][2].result()] == ['a']
+    assert isinstance(items[1][2].exception(), ValueError)
+    assert [r['image'] for r in items[2][2].result()] == ['c']
+
+
+def test_dispatch_single_request_gets_exception():
+    bad = object()
+    batcher = app.OcrBatcher(StubOCR(fail_on=bad))
+    future = Future()
+    batcher._dispatch([([bad], {}, future)])
+    assert isinstance(future.exception(), ValueError)
+
+
+def test_batcher_groups_requests_by_options(monkeypatch):
+    monkeypatch.setattr(app, 'BATCH_WINDOW', 0.2)
+    ocr = StubOCR()
+    batcher = app.OcrBatcher(ocr)
+    # Encolados antes de arrancar el hilo: caen todos en la misma ventana
+    futures = []
+    for images, kwargs in ((['a'], {'x': 1}), (['b'], {'x': 2}), (['c'], {'x': 1})):
+        future = Future()
+        batcher.queue.put((images, kwargs, future))
+        futures.append(future)
+    batcher._ensure_worker()
+    results = [f.result(timeout=5) for f in futures]
+    assert sorted((imgs, kw['x']) for imgs, kw in ocr.calls) == [(['a', 'c'], 1), (['b'], 2)]
+    assert [r[0]['image'] for r in results] == ['a', 'b', 'c']
+    assert [r[0]['kwargs'] for r in results] == [{'x': 1}, {'x': 2}, {'x': 1}]
+
+
+def test_batcher_caps_batch_size(monkeypatch):
+    monkeypatch.setattr(app, 'BATCH_WINDOW', 0.2)
+    monkeypatch.setattr(app, 'MAX_BATCH_SIZE', 2)
+    ocr = StubOCR()
+    batcher = app.OcrBatcher(ocr)
+    futures = []
+    for image in 'abcde':
+        future = Future()
+        batcher.queue.put(([image], {}, future))
+        futures.append(future)
+    batcher._ensure_worker()
+    for future in futures:
+        future.result(timeout=5)
+    assert all(len(images) <= 2 for images, _ in ocr.calls)
+    assert sorted(img for images, _ in ocr.calls for img in images) == list('abcde')
+
+
+def test_batcher_concurrent_submit():
+    ocr = StubOCR()
+    batcher = app.OcrBatcher(ocr)
+    results = {}
+
+    def worker(name):
+        results[name] = batcher.predict([name])
+
+    threads = [threading.Thread(target=worker, args=(str(i),)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    assert {name: r[0]['image'] for name, r in results.items()} == {str(i): str(i) for i in range(8)}